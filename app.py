@@ -1,12 +1,21 @@
 import os
-import json
+import asyncio
+import re
 import secrets
 import hashlib
-from typing import Optional, Dict
+import time
+import tempfile
+import threading
+from functools import lru_cache
+from typing import Optional, Dict, Tuple
 
+import orjson
 import pandas as pd
-from fastapi import FastAPI, Request, Form, Depends
-from fastapi.responses import RedirectResponse, FileResponse, HTMLResponse
+from argon2 import PasswordHasher
+from argon2.exceptions import VerificationError, InvalidHashError
+from openpyxl import Workbook
+from fastapi import FastAPI, Request, Form, Depends, HTTPException
+from fastapi.responses import RedirectResponse, FileResponse, HTMLResponse, Response
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
 from starlette.middleware.sessions import SessionMiddleware
@@ -14,9 +23,10 @@ from starlette.middleware.sessions import SessionMiddleware
 # ---------- Config ----------
 APP_NAME = "ConnectionDB"
 EXCEL_FILE = "connections.xlsx"
-USERS_FILE = "users.json"   # stores {"username": "salt$hex_hash", ...}
+USERS_FILE = "users.json"   # stores {"username": "$argon2id$...", ...} (or legacy "salt$hex_hash")
 SESSION_SECRET = os.environ.get("SESSION_SECRET", secrets.token_hex(32))
 DEFAULT_ADMIN = {"username": "admin", "password": "secret123"}  # change after first run!
+EMAIL_RE = re.compile(r"[^@\s]+@[^@\s]+\.[^@\s]+")
 
 # ---------- App init ----------
 app = FastAPI(title=APP_NAME)
@@ -24,62 +34,201 @@ app.add_middleware(SessionMiddleware, secret_key=SESSION_SECRET)
 app.mount("/static", StaticFiles(directory="static"), name="static")
 templates = Jinja2Templates(directory="templates")
 
-# ---------- Utilities: password hashing (PBKDF2) ----------
-def hash_password(password: str, salt: Optional[bytes] = None) -> str:
+# ---------- Utilities: password hashing (Argon2, legacy PBKDF2) ----------
+_hasher = PasswordHasher()
+
+def hash_password(password: str) -> str:
+    """
+    Return an Argon2id hash string ($argon2id$v=19$...), salt included.
+    """
+    return _hasher.hash(password)
+
+def is_legacy_hash(stored: str) -> bool:
     """
-    Return a string salt_hex$hash_hex where hash = pbkdf2_hmac('sha256', password, salt, 200000)
+    Hashes created before the switch to Argon2 are salt_hex$hash_hex with
+    hash = pbkdf2_hmac('sha256', password, salt, 200000).
     """
-    if salt is None:
-        salt = secrets.token_bytes(16)
-    dk = hashlib.pbkdf2_hmac("sha256", password.encode("utf-8"), salt, 200_000)
-    return f"{salt.hex()}${dk.hex()}"
+    return not stored.startswith("$")
 
 def verify_password(password: str, stored: str) -> bool:
+    if not is_legacy_hash(stored):
+        try:
+            return _hasher.verify(stored, password)
+        except (VerificationError, InvalidHashError):
+            return False
     try:
         salt_hex, hash_hex = stored.split("$")
         salt = bytes.fromhex(salt_hex)
+        expected = bytes.fromhex(hash_hex)
         candidate = hashlib.pbkdf2_hmac("sha256", password.encode("utf-8"), salt, 200_000)
-        return secrets.compare_digest(candidate.hex(), hash_hex)
+        return secrets.compare_digest(candidate, expected)
     except Exception:
         return False
 
+def needs_rehash(stored: str) -> bool:
+    return is_legacy_hash(stored) or _hasher.check_needs_rehash(stored)
+
+# ---------- Recent-login cache ----------
+# username -> (stored hash, keyed digest of the password, monotonic time of the last successful verify)
+LOGIN_CACHE_TTL = 30
+_LOGIN_CACHE_KEY = secrets.token_bytes(32)
+_recent_logins: Dict[str, Tuple[str, bytes, float]] = {}
+
+def _login_digest(username: str, password: str) -> bytes:
+    return hashlib.blake2b(f"{username}\0{password}".encode("utf-8"), key=_LOGIN_CACHE_KEY, digest_size=16).digest()
+
+def recently_verified(username: str, password: str, stored: str) -> bool:
+    """
+    True if this exact password was verified against the current stored hash
+    within LOGIN_CACHE_TTL seconds, letting repeat logins skip the slow hash.
+    """
+    entry = _recent_logins.get(username)
+    if not entry or entry[0] != stored or time.monotonic() - entry[2] >= LOGIN_CACHE_TTL:
+        return False
+    return secrets.compare_digest(entry[1], _login_digest(username, password))
+
+def remember_login(username: str, password: str, stored: str):
+    _recent_logins[username] = (stored, _login_digest(username, password), time.monotonic())
+
+# ---------- File helpers ----------
+def _file_mode(path: str) -> int:
+    try:
+        return os.stat(path).st_mode & 0o777
+    except FileNotFoundError:
+        # no portable way to read the umask without setting it; only hit when first creating the file
+        umask = os.umask(0)
+        os.umask(umask)
+        return 0o666 & ~umask
+
+def replace_file(path: str, write):
+    """
+    Call write(tmp_path) on a temp file next to path, then swap it in with
+    os.replace, so concurrent readers only ever see a complete file.
+    """
+    fd, tmp_path = tempfile.mkstemp(suffix=os.path.splitext(path)[1], dir=os.path.dirname(os.path.abspath(path)))
+    os.close(fd)
+    try:
+        # mkstemp creates 0600; keep the mode the file already had (or would get from open())
+        os.chmod(tmp_path, _file_mode(path))
+        write(tmp_path)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
 # ---------- Users file management ----------
+# held around load-modify-save of users.json; login and change-password run on parallel threads
+_users_lock = threading.Lock()
+
 def ensure_users_file():
     if not os.path.exists(USERS_FILE):
         # create with one default admin user (please change password after first login)
         hashed = hash_password(DEFAULT_ADMIN["password"])
-        with open(USERS_FILE, "w") as f:
-            json.dump({DEFAULT_ADMIN["username"]: hashed}, f)
+        with open(USERS_FILE, "wb") as f:
+            f.write(orjson.dumps({DEFAULT_ADMIN["username"]: hashed}))
         print(f"Created {USERS_FILE} with default credentials: {DEFAULT_ADMIN['username']} / {DEFAULT_ADMIN['password']}")
 
+@lru_cache(maxsize=1)
+def _users_cached(mtime: int) -> Dict[str, str]:
+    # mtime is only the cache key: a write to users.json (by us or by hand) invalidates it
+    with open(USERS_FILE, "rb") as f:
+        return orjson.loads(f.read())
+
 def load_users() -> Dict[str, str]:
     ensure_users_file()
-    with open(USERS_FILE, "r") as f:
-        return json.load(f)
+    return dict(_users_cached(os.stat(USERS_FILE).st_mtime_ns))
 
 def save_users(users: Dict[str, str]):
-    with open(USERS_FILE, "w") as f:
-        json.dump(users, f)
+    data = orjson.dumps(users)
+
+    def write(path):
+        with open(path, "wb") as f:
+            f.write(data)
+
+    replace_file(USERS_FILE, write)
+    # a rewrite within one mtime tick wouldn't change the cache key
+    _users_cached.cache_clear()
+
+def set_user_hash(username: str, expected: str, new_hash: str) -> bool:
+    """
+    Replace username's hash only if it is still `expected`, so a stale copy of
+    the users map can't undo someone else's concurrent change.
+    """
+    with _users_lock:
+        users = load_users()
+        if users.get(username) != expected:
+            return False
+        users[username] = new_hash
+        save_users(users)
+        return True
 
 # ---------- Excel helpers ----------
-def load_data():
+COLUMNS = ["Name", "Company", "Connection Link", "Email", "Phone No.", "Role"]
+
+# parsed workbook, reused until the file on disk changes. "entry" is a single
+# (mtime, df) tuple so readers and writers on other threads never see a mixed pair;
+# "saves" counts our own writes, which may land within one mtime tick
+_df_cache = {"entry": None, "saves": 0}
+# rendered listing pages per (query, user): "entry" is a (data_version(), pages) tuple,
+# replaced as a whole so threads never see a version paired with the wrong pages
+INDEX_CACHE_SIZE = 256
+_index_cache = {"entry": None}
+# serializes load-modify-save in the mutating routes so concurrent edits aren't lost
+_write_lock = asyncio.Lock()
+
+def ensure_data_file():
     if not os.path.exists(EXCEL_FILE):
-        df = pd.DataFrame(columns=["Name", "Company", "Connection Link", "Email", "Phone No.", "Role"])
-        df.to_excel(EXCEL_FILE, index=False)
-    return pd.read_excel(EXCEL_FILE)
+        save_data(pd.DataFrame(columns=COLUMNS))
+
+def load_data(copy: bool = True):
+    """
+    Return the connections frame. Pass copy=False only on read-only paths: the
+    cached frame is shared, and editing it would bypass save_data.
+    """
+    ensure_data_file()
+    mtime = os.stat(EXCEL_FILE).st_mtime_ns
+    entry = _df_cache["entry"]
+    if entry is None or entry[0] != mtime:
+        # calamine (Rust) parses xlsx much faster than the default openpyxl engine
+        # every column is free text; keep it as str so phone numbers aren't
+        # parsed as floats and empty cells don't render as "nan"
+        entry = (mtime, pd.read_excel(EXCEL_FILE, engine="calamine", dtype=str).fillna(""))
+        _df_cache["entry"] = entry
+    return entry[1].copy() if copy else entry[1]
 
 def save_data(df):
-    df.to_excel(EXCEL_FILE, index=False)
+    """
+    Stream rows through a write-only workbook; skips the per-cell style
+    bookkeeping that df.to_excel goes through.
+    """
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet()
+    ws.append(list(df.columns))
+    for row in df.itertuples(index=False, name=None):
+        # openpyxl can't write NaN, leave the cell empty instead
+        ws.append([None if pd.isna(v) or v == "" else str(v) for v in row])
+    # swap in a complete file, so unlocked readers never see a partial workbook
+    replace_file(EXCEL_FILE, wb.save)
+    _df_cache["entry"] = (os.stat(EXCEL_FILE).st_mtime_ns, df.reset_index(drop=True).fillna("").astype(str))
+    _df_cache["saves"] += 1
+    _index_cache["entry"] = None
+
+def data_version():
+    return os.stat(EXCEL_FILE).st_mtime_ns, _df_cache["saves"]
 
 # ---------- Auth helpers ----------
 def get_current_user(request: Request) -> Optional[str]:
     return request.session.get("user")
 
-def require_login(request: Request):
+def require_auth(request: Request) -> str:
+    """
+    Dependency for protected routes: returns the logged-in username or
+    redirects to the login page, coming back to the current path afterwards.
+    """
     user = get_current_user(request)
     if not user:
-        return RedirectResponse(url="/login?next=" + request.url.path, status_code=303)
-    return None
+        raise HTTPException(status_code=303, headers={"Location": "/login?next=" + request.url.path})
+    return user
 
 # ---------- Routes ----------
 @app.get("/", response_class=HTMLResponse)
@@ -87,11 +236,33 @@ def index(request: Request, q: Optional[str] = None):
     """
     Public listing (read-only). Add/Edit/Download require login.
     """
-    df = load_data()
+    user = get_current_user(request)
+    key = (q or "", user)
+    ensure_data_file()
+    # taken before loading: if a save lands mid-render the page is tagged older than its data, never newer
+    version = data_version()
+    entry = _index_cache["entry"]
+    if entry is not None and entry[0] == version:
+        # single lookup: a save on another thread may swap the dict out at any point
+        page = entry[1].get(key)
+        if page is not None:
+            return HTMLResponse(page)
+    df = load_data(copy=False)
     if q:
-        df = df[df.apply(lambda row: row.astype(str).str.contains(q, case=False, na=False).any(), axis=1)]
-    records = df.to_dict(orient="records")
-    return templates.TemplateResponse("index.html", {"request": request, "records": records, "query": q, "user": get_current_user(request)})
+        # one vectorized substring pass per column instead of a Python call per row
+        mask = pd.Series(False, index=df.index)
+        for col in df.columns:
+            mask |= df[col].str.contains(q, case=False, regex=False, na=False)
+        df = df[mask]
+    # plain (idx, name, company, link, email, phone, role) tuples; cheaper than a dict per row
+    records = list(df.itertuples(name=None))
+    html = templates.get_template("index.html").render({"request": request, "records": records, "query": q, "user": user})
+    entry = _index_cache["entry"]
+    if entry is None or entry[0] != version or len(entry[1]) >= INDEX_CACHE_SIZE:
+        entry = (version, {})
+        _index_cache["entry"] = entry
+    entry[1][key] = html
+    return HTMLResponse(html)
 
 # ---------------- Login / logout ----------------
 @app.get("/login", response_class=HTMLResponse)
@@ -102,7 +273,17 @@ def login_page(request: Request, next: Optional[str] = "/"):
 def do_login(request: Request, username: str = Form(...), password: str = Form(...), next: Optional[str] = Form("/")):
     users = load_users()
     stored = users.get(username)
+    if stored and recently_verified(username, password, stored):
+        request.session["user"] = username
+        return RedirectResponse(next or "/", status_code=303)
     if stored and verify_password(password, stored):
+        if needs_rehash(stored):
+            # upgrade legacy PBKDF2 / outdated Argon2 params while we have the plaintext
+            new_hash = hash_password(password)
+            if set_user_hash(username, stored, new_hash):
+                stored = new_hash
+        # only a full verify starts the TTL, so repeat logins can't keep it alive
+        remember_login(username, password, stored)
         request.session["user"] = username
         return RedirectResponse(next or "/", status_code=303)
     # invalid
@@ -115,85 +296,92 @@ def logout(request: Request):
 
 # ---------------- Add record (protected) ----------------
 @app.get("/add")
-def add_page(request: Request):
-    if get_current_user(request) is None:
-        return RedirectResponse("/login?next=/add", status_code=303)
-    return templates.TemplateResponse("add.html", {"request": request, "user": get_current_user(request)})
+async def add_page(request: Request, user: str = Depends(require_auth)):
+    return templates.TemplateResponse("add.html", {"request": request, "user": user})
 
 @app.post("/add")
-def add_record(request: Request,
-               name: str = Form(...),
-               company: str = Form(...),
-               connection_link: str = Form(...),
-               email: str = Form(...),
-               phone: Optional[str] = Form(None),
-               role: str = Form(...)):
-    if get_current_user(request) is None:
-        return RedirectResponse("/login?next=/add", status_code=303)
+async def add_record(request: Request,
+                   name: str = Form(...),
+                   company: str = Form(...),
+                   connection_link: str = Form(...),
+                   email: str = Form(...),
+                   phone: Optional[str] = Form(None),
+                   role: str = Form(...),
+                   user: str = Depends(require_auth)):
     # basic email validation
-    if "@" not in email or "." not in email:
-        return templates.TemplateResponse("add.html", {"request": request, "user": get_current_user(request), "error": "Invalid email"})
-    df = load_data()
-    new_row = {"Name": name, "Company": company, "Connection Link": connection_link,
-               "Email": email, "Phone No.": phone, "Role": role}
-    df = pd.concat([df, pd.DataFrame([new_row])], ignore_index=True)
-    save_data(df)
+    if not EMAIL_RE.fullmatch(email):
+        return templates.TemplateResponse("add.html", {"request": request, "user": user, "error": "Invalid email"})
+    async with _write_lock:
+        df = await asyncio.to_thread(load_data)
+        df.loc[len(df)] = [name, company, connection_link, email, phone, role]
+        await asyncio.to_thread(save_data, df)
     return RedirectResponse("/", status_code=303)
 
 # ---------------- Update record (protected) ----------------
 @app.get("/update/{idx}")
-def update_page(request: Request, idx: int):
-    if get_current_user(request) is None:
-        return RedirectResponse(f"/login?next=/update/{idx}", status_code=303)
-    df = load_data()
+async def update_page(request: Request, idx: int, user: str = Depends(require_auth)):
+    df = await asyncio.to_thread(load_data, copy=False)
     if idx < 0 or idx >= len(df):
         return RedirectResponse("/", status_code=303)
     record = df.iloc[idx].to_dict()
-    return templates.TemplateResponse("update.html", {"request": request, "record": record, "idx": idx, "user": get_current_user(request)})
+    return templates.TemplateResponse("update.html", {"request": request, "record": record, "idx": idx, "user": user})
 
 @app.post("/update/{idx}")
-def update_record(request: Request, idx: int,
-                  name: str = Form(...),
-                  company: str = Form(...),
-                  connection_link: str = Form(...),
-                  email: str = Form(...),
-                  phone: Optional[str] = Form(None),
-                  role: str = Form(...)):
-    if get_current_user(request) is None:
-        return RedirectResponse(f"/login?next=/update/{idx}", status_code=303)
-    df = load_data()
-    if 0 <= idx < len(df):
-        df.loc[idx] = [name, company, connection_link, email, phone, role]
-        save_data(df)
+async def update_record(request: Request, idx: int,
+                      name: str = Form(...),
+                      company: str = Form(...),
+                      connection_link: str = Form(...),
+                      email: str = Form(...),
+                      phone: Optional[str] = Form(None),
+                      role: str = Form(...),
+                      user: str = Depends(require_auth)):
+    async with _write_lock:
+        df = await asyncio.to_thread(load_data)
+        if 0 <= idx < len(df):
+            df.loc[idx] = [name, company, connection_link, email, phone, role]
+            await asyncio.to_thread(save_data, df)
     return RedirectResponse("/", status_code=303)
 
 # ---------------- Download (protected) ----------------
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """
+    Weak comparison against an If-None-Match header: a list of tags, each possibly W/-prefixed, or "*".
+    """
+    if not if_none_match:
+        return False
+    for tag in if_none_match.split(","):
+        tag = tag.strip()
+        if tag == "*" or tag.removeprefix("W/") == etag:
+            return True
+    return False
+
 @app.get("/download")
-def download_excel(request: Request):
-    if get_current_user(request) is None:
-        return RedirectResponse("/login?next=/download", status_code=303)
-    return FileResponse(EXCEL_FILE, filename="connections.xlsx")
+async def download_excel(request: Request, user: str = Depends(require_auth)):
+    await asyncio.to_thread(ensure_data_file)
+    st = os.stat(EXCEL_FILE)
+    # the xlsx is rewritten on every add/update, so mtime+size identifies its content
+    etag = '"' + hashlib.blake2b(f"{st.st_mtime_ns}:{st.st_size}".encode(), digest_size=8).hexdigest() + '"'
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=headers)
+    return FileResponse(EXCEL_FILE, filename="connections.xlsx", headers=headers)
 
 # ---------------- Admin: change password (optional) ----------------
 @app.get("/change-password")
-def changePassword_page(request: Request):
-    if get_current_user(request) is None:
-        return RedirectResponse("/login?next=/change-password", status_code=303)
-    return templates.TemplateResponse("changePassword.html", {"request": request, "user": get_current_user(request), "error": None, "success": None})
+def changePassword_page(request: Request, user: str = Depends(require_auth)):
+    return templates.TemplateResponse("changePassword.html", {"request": request, "user": user, "error": None, "success": None})
 
 @app.post("/change-password")
-def changePassword(request: Request, current: str = Form(...), new_password: str = Form(...), confirm: str = Form(...)):
-    username = get_current_user(request)
-    if username is None:
-        return RedirectResponse("/login?next=/change-password", status_code=303)
+def changePassword(request: Request, current: str = Form(...), new_password: str = Form(...), confirm: str = Form(...),
+                   username: str = Depends(require_auth)):
     users = load_users()
     stored = users.get(username)
     if not stored or not verify_password(current, stored):
         return templates.TemplateResponse("changePassword.html", {"request": request, "user": username, "error": "Current password incorrect", "success": None})
     if new_password != confirm:
         return templates.TemplateResponse("changePassword.html", {"request": request, "user": username, "error": "Passwords do not match", "success": None})
-    users[username] = hash_password(new_password)
-    save_users(users)
+    if not set_user_hash(username, stored, hash_password(new_password)):
+        return templates.TemplateResponse("changePassword.html", {"request": request, "user": username, "error": "Password was changed concurrently, please retry", "success": None})
     return templates.TemplateResponse("changePassword.html", {"request": request, "user": username, "error": None, "success": "Password updated"})
 
 # create default users file (if needed) at startup